@@ -1,12 +1,30 @@
+import random
+
 import streamlit as st
 import pandas as pd
-import pdfplumber
-import re
-import gspread
-import hashlib, hmac
 from datetime import datetime, timezone, timedelta
-from oauth2client.service_account import ServiceAccountCredentials
-from gspread.exceptions import APIError, WorksheetNotFound
+
+from rpo_core import (
+    EXPECTED_Q_COLS,
+    RESULT_COLS,
+    append_records,
+    append_rows_batch,
+    clear_read_cache,
+    delete_rows_by_question,
+    df_to_rows,
+    extract_answer_key,
+    extract_answer_keys,
+    hash_password,
+    load_data,
+    load_results,
+    load_users,
+    parse_exam_pdf_columns,
+    question_index,
+    read_many,
+    save_to_google,
+    save_users,
+    verify_password,
+)
 
 # =========================================================
 # 基本設定
@@ -14,391 +32,11 @@ from gspread.exceptions import APIError, WorksheetNotFound
 st.set_page_config(page_title="質子中心-輻防師特訓平台 (雲端版)", layout="wide", page_icon="☢️")
 TZ_TAIPEI = timezone(timedelta(hours=8))
 
-SHEET_NAME = "Pro_Database"  # Google Sheet 檔名（不是分頁名）
-
 # 介面語句（可自訂）
 MSG_CORRECT = "還可以嘛！👌"
 MSG_WRONG = "到底行不行啊！😤"
 
-EXPECTED_Q_COLS = [
-    "question", "option_A", "option_B", "option_C", "option_D",
-    "correct_answer", "explanation", "topic", "type"
-]
-USER_COLS = ["username", "password_hash", "role", "created_at", "enabled"]
-RESULT_COLS = ["ts", "username", "mode", "score", "total", "percent", "wrong_count"]
-
-DEFAULT_HEADERS = {
-    "Questions": EXPECTED_Q_COLS,
-    "Mistakes": EXPECTED_Q_COLS,
-    "Users": USER_COLS,
-    "Results": RESULT_COLS,
-}
-
-# =========================================================
-# Google Sheets 連線
-# =========================================================
-@st.cache_resource
-def init_connection():
-    scope = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    if "gcp_service_account" not in st.secrets:
-        st.error("⚠️ 未偵測到 Secrets 設定！請在 Streamlit Cloud 後台設定 [gcp_service_account]。")
-        return None
-
-    creds_dict = st.secrets["gcp_service_account"]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    return gspread.authorize(creds)
-
-
-def get_or_create_worksheet(sh, name, rows=2000, cols=30):
-    """
-    強化版：避免 Streamlit rerun / 多 session 併發時重複建立同名 sheet。
-    就算 add_worksheet 回 400 already exists，也能安全拿回現有 worksheet。
-    若是新建，會自動寫入對應的 header。
-    """
-    name = str(name).strip()
-
-    # 1) 先直接拿
-    try:
-        return sh.worksheet(name)
-    except WorksheetNotFound:
-        pass
-
-    # 2) 再掃一次
-    try:
-        for ws in sh.worksheets():
-            if ws.title.strip() == name:
-                return ws
-    except Exception:
-        pass
-
-    # 3) 建立（撞名就回頭拿現成）
-    try:
-        ws = sh.add_worksheet(title=name, rows=rows, cols=cols)
-    except APIError as e:
-        msg = str(e)
-        if ("already exists" in msg) or ("addSheet" in msg):
-            return sh.worksheet(name)
-        raise
-
-    # 4) 新建才寫 header
-    headers = DEFAULT_HEADERS.get(name)
-    if headers:
-        ws.append_row(headers)
-    return ws
-
-
-# =========================================================
-# Auth（簡單帳號密碼 / 成績紀錄）
-# =========================================================
-def _get_auth_pepper():
-    # 建議在 secrets 加：auth_pepper = "一串很亂很長的字串"
-    return st.secrets.get("auth_pepper", "CHANGE_ME_PLEASE")
-
-def hash_password(password: str, salt: str) -> str:
-    pepper = _get_auth_pepper().encode("utf-8")
-    dk = hashlib.pbkdf2_hmac(
-        "sha256",
-        (password.strip().encode("utf-8") + pepper),
-        salt.encode("utf-8"),
-        120_000,
-    )
-    return dk.hex()
-
-def verify_password(password: str, salt: str, stored_hash: str) -> bool:
-    return hmac.compare_digest(hash_password(password, salt), str(stored_hash))
-
-# =========================================================
-# 資料讀寫（Questions/Mistakes/Users/Results）
-# =========================================================
-def load_data(worksheet_name: str) -> pd.DataFrame:
-    """通用讀取：保證回傳 DataFrame，且必要欄位會補齊"""
-    expected = DEFAULT_HEADERS.get(worksheet_name, None)
-
-    try:
-        client = init_connection()
-        if not client:
-            return pd.DataFrame(columns=expected or [])
-
-        sh = client.open(SHEET_NAME)
-        ws = get_or_create_worksheet(sh, worksheet_name)
-
-        data = ws.get_all_records()
-        if not data:
-            return pd.DataFrame(columns=expected or [])
-
-        df = pd.DataFrame(data)
-
-        # 補欄位
-        if expected:
-            for c in expected:
-                if c not in df.columns:
-                    df[c] = ""
-            return df[expected]
-
-        return df
-
-    except Exception as e:
-        st.error(
-            "連線/資料錯誤（可能是欄位被刪、或資料表空白）\n"
-            f"詳細錯誤: {repr(e)}"
-        )
-        return pd.DataFrame(columns=expected or [])
-
-
-def save_to_google(worksheet_name: str, new_df: pd.DataFrame):
-    """覆蓋寫入（適用 Questions / Mistakes / Users），Results 請用 append_result"""
-    try:
-        client = init_connection()
-        if not client:
-            st.error("❌ 無法建立 Google Sheets 連線（Secrets 可能未設定）")
-            return
-
-        sh = client.open(SHEET_NAME)
-        ws = get_or_create_worksheet(sh, worksheet_name)
-
-        expected = DEFAULT_HEADERS.get(worksheet_name)
-        if expected:
-            for c in expected:
-                if c not in new_df.columns:
-                    new_df[c] = ""
-            new_df = new_df[expected]
-
-        ws.clear()
-        if new_df is None or new_df.empty:
-            ws.update([expected or []])
-            return
-
-        ws.update([new_df.columns.values.tolist()] + new_df.values.tolist())
-
-    except Exception as e:
-        st.error(f"寫入失敗: {repr(e)}")
-
-
-def append_result(row: dict):
-    """追加寫入 Results（不要 clear，不然大家成績會互相洗掉）"""
-    try:
-        client = init_connection()
-        if not client:
-            st.error("❌ 無法建立 Google Sheets 連線")
-            return
-
-        sh = client.open(SHEET_NAME)
-        ws = get_or_create_worksheet(sh, "Results", rows=8000, cols=20)
-
-        # 若表是空的（沒 header），補 header
-        values = ws.get_all_values()
-        if not values:
-            ws.append_row(RESULT_COLS)
-
-        ws.append_row([row.get(c, "") for c in RESULT_COLS])
-
-    except Exception as e:
-        st.error(f"成績寫入失敗: {repr(e)}")
-
-
-def load_users() -> pd.DataFrame:
-    df = load_data("Users")
-    for c in USER_COLS:
-        if c not in df.columns:
-            df[c] = ""
-    # enabled 預設 true
-    if "enabled" in df.columns:
-        df["enabled"] = df["enabled"].astype(str).replace({"": "TRUE"})
-    return df[USER_COLS]
-
-
-def save_users(df: pd.DataFrame):
-    for c in USER_COLS:
-        if c not in df.columns:
-            df[c] = ""
-    save_to_google("Users", df[USER_COLS])
-
-
-def load_results() -> pd.DataFrame:
-    df = load_data("Results")
-    for c in RESULT_COLS:
-        if c not in df.columns:
-            df[c] = ""
-    return df[RESULT_COLS]
-
-
-# =========================================================
-# 題目工具
-# =========================================================
-def extract_answer_key(text):
-    if pd.isna(text):
-        return ""
-    text = str(text).strip()
-    match = re.match(r"^[\(（]?([1-4A-Da-d])[\)）\.]?", text)
-    if match:
-        val = match.group(1).upper()
-        mapping = {"1": "A", "2": "B", "3": "C", "4": "D"}
-        return mapping.get(val, val)
-    return ""
-
-
-def parse_exam_pdf(text):
-    """
-    v7.2+：
-    - 支援 [解:] / [解：] / [解]
-    - 選項記號可在行中，會完整拆 (1)(2)(3)(4)
-    - 選項跨行：沒有新 (n) 記號就接到上一個選項
-    - 題型辨識：少於 3 個選項 => essay（避免把(1)(2)子題當選擇）
-    - 忽略頁尾：第X頁/共Y頁
-    """
-    questions = []
-    lines = text.split("\n")
-
-    current_q = None
-    state = "SEARCH_Q"
-    last_opt = None
-
-    def is_footer(s: str) -> bool:
-        return bool(re.match(r"^第\s*\d+\s*頁/共\s*\d+\s*頁", s.strip()))
-
-    def is_answer_marker(s: str) -> bool:
-        return bool(re.search(r"\[解(?:[:：])?\]", s))
-
-    def split_options_anywhere(s: str):
-        # 支援 (1) 或 （1）
-        pat = r"[（(]([1-4])[）)]"
-        hits = list(re.finditer(pat, s))
-        if not hits:
-            return {}
-        out = {}
-        for i, m in enumerate(hits):
-            n = m.group(1)
-            start = m.start()
-            end = hits[i + 1].start() if i + 1 < len(hits) else len(s)
-            chunk = s[start:end].strip()
-            out[n] = chunk
-        return out
-
-    def finalize_question(q: dict) -> dict:
-        opts = [
-            str(q.get("option_A", "")).strip(),
-            str(q.get("option_B", "")).strip(),
-            str(q.get("option_C", "")).strip(),
-            str(q.get("option_D", "")).strip(),
-        ]
-        non_empty = [o for o in opts if o]
-
-        # 少於 3 個選項：視為非選擇題（(1)(2)子題很常見）
-        if len(non_empty) < 3:
-            q["type"] = "essay"
-            # 把可能被誤塞進選項的內容搬到 explanation（不要丟資料）
-            extra = []
-            if q.get("option_A"): extra.append(q["option_A"])
-            if q.get("option_B"): extra.append(q["option_B"])
-            if q.get("option_C"): extra.append(q["option_C"])
-            if q.get("option_D"): extra.append(q["option_D"])
-            if extra and not q.get("explanation"):
-                q["explanation"] = "\n".join(extra)
-
-            q["option_A"] = q["option_B"] = q["option_C"] = q["option_D"] = ""
-            q["correct_answer"] = ""
-        else:
-            q["type"] = "choice"
-        return q
-
-    for raw in lines:
-        line = raw.strip()
-        if not line or is_footer(line):
-            continue
-
-        # 新題目（題號 1. / 1 ）
-        if re.match(r"^\d+[\.\s]", line):
-            if current_q and "question" in current_q:
-                questions.append(finalize_question(current_q))
-
-            current_q = {
-                "question": line,
-                "option_A": "",
-                "option_B": "",
-                "option_C": "",
-                "option_D": "",
-                "correct_answer": "",
-                "explanation": "",
-                "topic": "",
-                "type": "choice",
-            }
-            state = "READING_Q"
-            last_opt = None
-            continue
-
-        if current_q is None:
-            continue
-
-        # 解答標記
-        if is_answer_marker(line):
-            after = re.sub(r".*\[解(?:[:：])?\]\s*", "", line).strip()
-            if after:
-                ans = extract_answer_key(after)
-                if ans:
-                    current_q["correct_answer"] = ans
-                current_q["explanation"] += after + "\n"
-                state = "READING_EXPL"
-            else:
-                state = "WAITING_FOR_ANS"
-            last_opt = None
-            continue
-
-        # 等待答案那行（通常只有 (3)）
-        if state == "WAITING_FOR_ANS":
-            ans = extract_answer_key(line)
-            if ans and not current_q.get("correct_answer"):
-                current_q["correct_answer"] = ans
-            current_q["explanation"] += line + "\n"
-            state = "READING_EXPL"
-            continue
-
-        # 讀題幹：直到遇到任何 (1)-(4)
-        if state == "READING_Q":
-            if split_options_anywhere(line):
-                state = "READING_OPT"
-            else:
-                current_q["question"] += " " + line
-                continue
-
-        # 讀選項：一行內可同時有多個 (n)
-        if state == "READING_OPT":
-            opts = split_options_anywhere(line)
-            if opts:
-                if "1" in opts:
-                    current_q["option_A"] = opts["1"]
-                    last_opt = "option_A"
-                if "2" in opts:
-                    current_q["option_B"] = opts["2"]
-                    last_opt = "option_B"
-                if "3" in opts:
-                    current_q["option_C"] = opts["3"]
-                    last_opt = "option_C"
-                if "4" in opts:
-                    current_q["option_D"] = opts["4"]
-                    last_opt = "option_D"
-                continue
-
-            # 沒有新選項記號 -> 接到上一個選項
-            if last_opt:
-                current_q[last_opt] = (current_q[last_opt] + " " + line).strip()
-                continue
-
-        # 解析內容
-        if state == "READING_EXPL":
-            if not current_q.get("correct_answer"):
-                ans = extract_answer_key(line)
-                if ans:
-                    current_q["correct_answer"] = ans
-            current_q["explanation"] += line + "\n"
-
-    if current_q and "question" in current_q:
-        questions.append(finalize_question(current_q))
-
-    return questions
-
+OPTS = ["A", "B", "C", "D"]
 
 # =========================================================
 # Session State 初始化
@@ -407,12 +45,48 @@ if "quiz_data" not in st.session_state:
     st.session_state.quiz_data = None
 if "quiz_submitted" not in st.session_state:
     st.session_state.quiz_submitted = False
+if "quiz_saved" not in st.session_state:
+    st.session_state.quiz_saved = False
 if "current_single_q" not in st.session_state:
     st.session_state.current_single_q = None
 if "single_q_revealed" not in st.session_state:
     st.session_state.single_q_revealed = False
+if "current_single_q_labels" not in st.session_state:
+    st.session_state.current_single_q_labels = {}
+if "mistakes_qset" not in st.session_state:
+    # 目前這一題已確認在錯題本裡：寫入後快取會被清掉，同一題 rerun 時不必再重讀錯題本。
+    # 錯題本是大家共用的（別人可能刪掉），所以每次抽題都清空，不跨題沿用
+    st.session_state.mistakes_qset = set()
 if "user" not in st.session_state:
     st.session_state.user = None
+if "questions_df" not in st.session_state:
+    st.session_state.questions_df = None
+if "quiz_labels" not in st.session_state:
+    st.session_state.quiz_labels = []
+if "quiz_rows" not in st.session_state:
+    st.session_state.quiz_rows = []
+
+
+def get_question_bank() -> pd.DataFrame:
+    """
+    題庫在這個 session 只讀一次並整理好（type 轉小寫、空白補 choice、存成 category；答案轉字串），
+    之後每次 rerun 直接拿 session_state，不再經過 cache_data 的 hash + 複製。
+    呼叫端不要原地改它；匯入 PDF / 清除快取 / 登出時會清掉重讀。
+    """
+    if st.session_state.questions_df is None:
+        df = load_data("Questions")
+        if df.empty:
+            return df  # 讀失敗或真的沒題目：不記住，下次 rerun 再試
+        # 題型只有幾種值：category 存整數代碼，每次 rerun 篩 choice 不必再逐列轉字串/小寫
+        df["type"] = df["type"].astype(str).str.lower().replace({"": "choice"}).astype("category")
+        df["correct_answer"] = df["correct_answer"].astype(str)
+        st.session_state.questions_df = df
+    return st.session_state.questions_df
+
+
+def option_labels(q) -> dict:
+    """{選項字母: 顯示文字}（nan 清掉、空選項顯示「X（空）」），radio 的 format_func 直接用 .get"""
+    return {k: (str(q.get(f"option_{k}", "")).replace("nan", "").strip() or f"{k}（空）") for k in OPTS}
 
 
 # =========================================================
@@ -476,8 +150,7 @@ with st.sidebar:
                             "created_at": created,
                             "enabled": "TRUE",
                         }
-                        users = pd.concat([users, pd.DataFrame([new_row])], ignore_index=True)
-                        save_users(users)
+                        append_records("Users", [new_row])
                         st.success(f"建立成功（角色：{role}）")
                         st.info("回到登入頁登入即可")
 
@@ -488,6 +161,7 @@ with st.sidebar:
     if st.button("🚪 登出"):
         st.session_state.user = None
         st.session_state.quiz_data = None
+        st.session_state.questions_df = None
         st.session_state.quiz_submitted = False
         st.session_state.current_single_q = None
         st.session_state.single_q_revealed = False
@@ -523,19 +197,23 @@ if mode == "📊 管理者後台（成績）":
         st.info("目前沒有任何測驗紀錄")
         st.stop()
 
-    res["percent_num"] = pd.to_numeric(res["percent"], errors="coerce")
+    # 分數用 float32 就夠；帳號轉 category，篩選/分組都改用整數代碼比
+    res["percent_num"] = pd.to_numeric(res["percent"], errors="coerce", downcast="float")
+    res["username"] = res["username"].astype(str).astype("category")
 
-    users = sorted([u for u in res["username"].astype(str).unique() if u.strip() != ""])
+    # 帳號欄選單和篩選共用；篩出來只拿來顯示/分組，不必再 copy
+    names = res["username"]
+    users = sorted(u for u in names.unique() if u.strip() != "")
     pick = st.multiselect("篩選使用者", users, default=users)
 
-    view = res[res["username"].astype(str).isin(pick)].copy()
+    view = res[names.isin(pick)]
     st.dataframe(view.drop(columns=["percent_num"], errors="ignore"), use_container_width=True)
 
     st.subheader("📌 使用者平均分數（%）")
+    # 最後會照分數排序，分組時就不必先排 username
     agg = (
-        view.groupby("username")["percent_num"]
+        view.groupby("username", sort=False, as_index=False, observed=True)["percent_num"]
         .mean()
-        .reset_index()
         .sort_values("percent_num", ascending=False)
     )
     st.dataframe(agg, use_container_width=True)
@@ -591,129 +269,131 @@ if mode == "👤 管理者後台（帳號）":
 # =========================================================
 if mode == "📝 模擬考模式":
     st.title("📝 雲端題庫模擬考")
-    df = load_data("Questions")
 
-    # 只抓 choice 題 + 選項至少三個 + 有答案
-    if not df.empty:
-        df["type"] = df["type"].astype(str).replace({"": "choice"})
-        df["correct_answer"] = df["correct_answer"].astype(str)
+    if st.session_state.quiz_data is None:
+        # 還沒開考才需要讀題庫；開考後題目都在 session_state，作答時的 rerun 不再碰題庫
+        df = get_question_bank()
 
-        valid_df = df[df["question"].notna() & (df["question"].astype(str).str.strip() != "")]
-        choice_df = valid_df[valid_df["type"].astype(str).str.lower().eq("choice")].copy()
-
-        def opt_count(r):
-            opts = [
-                str(r.get("option_A", "")).strip(),
-                str(r.get("option_B", "")).strip(),
-                str(r.get("option_C", "")).strip(),
-                str(r.get("option_D", "")).strip(),
-            ]
-            return sum(1 for o in opts if o and o.lower() != "nan")
-
-        if not choice_df.empty:
-            choice_df["opt_cnt"] = choice_df.apply(opt_count, axis=1)
-            choice_df = choice_df[
-                (choice_df["opt_cnt"] >= 3)
-                & (choice_df["correct_answer"].astype(str).str.strip() != "")
-            ].drop(columns=["opt_cnt"], errors="ignore")
-
-        if len(choice_df) == 0:
-            st.warning("雲端題庫沒有可用的選擇題（請先匯入 PDF 或檢查解析結果）。")
+        if df.empty:
+            st.warning("題庫目前是空的，請先匯入 PDF。")
         else:
-            if st.session_state.quiz_data is None:
+            # 只抓 choice 題 + 選項至少三個 + 有答案
+            valid_df = df[df["question"].notna() & (df["question"].astype(str).str.strip() != "")]
+            choice_df = valid_df[valid_df["type"].eq("choice")].copy()
+
+            if not choice_df.empty:
+                # 選項數整欄一起算（不用 apply(axis=1) 每題呼叫一次 Python 函式）
+                opts = choice_df[["option_A", "option_B", "option_C", "option_D"]].astype(str)
+                opts = opts.apply(lambda c: c.str.strip())
+                opt_cnt = (opts.ne("") & opts.apply(lambda c: c.str.lower()).ne("nan")).sum(axis=1)
+                choice_df = choice_df[
+                    (opt_cnt >= 3)
+                    & (choice_df["correct_answer"].astype(str).str.strip() != "")
+                ]
+
+            if len(choice_df) == 0:
+                st.warning("雲端題庫沒有可用的選擇題（請先匯入 PDF 或檢查解析結果）。")
+            else:
                 st.info(f"雲端可用選擇題：{len(choice_df)} 題。")
                 num = st.number_input("題數", 1, len(choice_df), min(20, len(choice_df)))
                 if st.button("🚀 開始測驗", type="primary"):
-                    st.session_state.quiz_data = choice_df.sample(n=num).reset_index(drop=True)
+                    # 只抽 num 個位置再切片，不必先把整份候選題洗牌複製一遍
+                    idx = random.sample(range(len(choice_df)), num)
+                    quiz = choice_df.iloc[idx].reset_index(drop=True)
+                    st.session_state.quiz_data = quiz
+                    # 逐題要用的 dict 和選項文字開考時就做好，作答/檢討的 rerun 直接拿
+                    st.session_state.quiz_rows = quiz.to_dict("records")
+                    st.session_state.quiz_labels = [option_labels(r) for r in st.session_state.quiz_rows]
                     st.session_state.quiz_submitted = False
                     st.rerun()
-            else:
-                with st.form("quiz_form"):
-                    user_answers = {}
-                    for index, row in st.session_state.quiz_data.iterrows():
-                        st.markdown(f"**Q{index+1}:** {row['question']}")
-                        opts = ["A", "B", "C", "D"]
-                        opt_labels = [
-                            str(row.get("option_A", "")),
-                            str(row.get("option_B", "")),
-                            str(row.get("option_C", "")),
-                            str(row.get("option_D", "")),
-                        ]
-                        clean_labels = [l.replace("nan", "").strip() for l in opt_labels]
-
-                        user_answers[index] = st.radio(
-                            f"q_{index}",
-                            opts,
-                            key=f"q_{index}",
-                            label_visibility="collapsed",
-                            format_func=lambda x: clean_labels[opts.index(x)] if clean_labels[opts.index(x)] else f"{x}（空）"
-                        )
-                        st.markdown("---")
-
-                    if st.form_submit_button("📝 交卷"):
-                        st.session_state.quiz_submitted = True
-
-                if st.session_state.quiz_submitted:
-                    score = 0
-                    wrong_entries = []
-                    total = len(st.session_state.quiz_data)
-
-                    for index, row in st.session_state.quiz_data.iterrows():
-                        user = user_answers.get(index)
-                        ans = extract_answer_key(row.get("correct_answer", ""))
+    else:
+        # 作答/交卷/檢討包成 fragment：交卷時只重跑這一段，側邊欄那些不用跟著整頁重畫
+        @st.fragment
+        def render_quiz():
+            # 開考時轉好的 list of dict，作答/檢討兩個迴圈共用（iterrows 每列都要建一個 Series）
+            rows = st.session_state.quiz_rows
+
+            with st.form("quiz_form"):
+                user_answers = {}
+                for index, row in enumerate(rows):
+                    st.markdown(f"**Q{index+1}:** {row['question']}")
+                    # 顯示文字開考時就算好了，format_func 直接查 dict
+                    labels = st.session_state.quiz_labels[index]
+
+                    user_answers[index] = st.radio(
+                        f"q_{index}",
+                        OPTS,
+                        key=f"q_{index}",
+                        label_visibility="collapsed",
+                        format_func=labels.get,
+                    )
+                    st.markdown("---")
+
+                if st.form_submit_button("📝 交卷"):
+                    st.session_state.quiz_submitted = True
+                    st.session_state.quiz_saved = False
+
+            if st.session_state.quiz_submitted:
+                quiz = st.session_state.quiz_data
+                total = len(quiz)
+
+                # 一次改完整份：答案 key 整欄抽出來，跟作答直接比
+                ans_keys = extract_answer_keys(quiz["correct_answer"])
+                user_keys = pd.Series([user_answers.get(i) for i in quiz.index], index=quiz.index)
+                correct_mask = user_keys.eq(ans_keys)
+                score = int(correct_mask.sum())
+                wrong_count = total - score
+
+                for index, (row, user, ans) in enumerate(zip(rows, user_keys, ans_keys)):
+                    with st.expander(f"第 {index+1} 題檢討", expanded=(user != ans)):
+                        # 直接用答案字母查欄位，不必每題組一個 list 再 index
+                        correct_text = str(row.get(f"option_{ans}")) if ans in OPTS else ans
 
                         if user == ans:
-                            score += 1
+                            st.success(f"{MSG_CORRECT} {correct_text}")
                         else:
-                            wrong_entries.append(row)
-
-                        with st.expander(f"第 {index+1} 題檢討", expanded=(user != ans)):
-                            opt_texts = [
-                                str(row.get("option_A")),
-                                str(row.get("option_B")),
-                                str(row.get("option_C")),
-                                str(row.get("option_D")),
-                            ]
-                            try:
-                                correct_text = opt_texts[["A", "B", "C", "D"].index(ans)]
-                            except Exception:
-                                correct_text = ans
-
-                            if user == ans:
-                                st.success(f"{MSG_CORRECT} {correct_text}")
-                            else:
-                                st.error(f"{MSG_WRONG} 正確是：{correct_text}")
-                            st.write(f"解析：{row.get('explanation', '')}")
-
-                    # 同步錯題
-                    if wrong_entries:
-                        wrong_df = pd.DataFrame(wrong_entries)
-                        old_mistakes = load_data("Mistakes")
-                        final_mistakes = pd.concat([old_mistakes, wrong_df], ignore_index=True)
-                        final_mistakes.drop_duplicates(subset=["question"], keep="last", inplace=True)
-                        save_to_google("Mistakes", final_mistakes)
-                        st.toast(f"已同步 {len(wrong_entries)} 題到雲端錯題本！", icon="☁️")
-
-                    percent = int(score / total * 100) if total else 0
-                    st.metric("成績", f"{percent} 分")
-
-                    # 寫入 Results
-                    append_result({
+                            st.error(f"{MSG_WRONG} 正確是：{correct_text}")
+                        st.write(f"解析：{row.get('explanation', '')}")
+
+                percent = int(score / total * 100) if total else 0
+                st.metric("成績", f"{percent} 分")
+
+                # 錯題 + 成績一次寫回雲端（rerun 時不重複寫）
+                if not st.session_state.quiz_saved:
+                    result = {
                         "ts": datetime.now(TZ_TAIPEI).strftime("%Y-%m-%d %H:%M:%S"),
                         "username": st.session_state.user["username"],
                         "mode": "mock_exam",
                         "score": score,
                         "total": total,
                         "percent": percent,
-                        "wrong_count": total - score,
-                    })
+                        "wrong_count": wrong_count,
+                    }
+                    writes = {"Results": [[result.get(c, "") for c in RESULT_COLS]]}
+                    new_wrong = {}
+                    if wrong_count:
+                        # 只追加錯題本還沒有的題目，不再整張表覆蓋；直接從 rows 組列，不另外建 DataFrame
+                        known = question_index("Mistakes")
+                        for row, ok in zip(rows, correct_mask):
+                            q_text = str(row["question"])
+                            if not ok and q_text not in known:
+                                new_wrong[q_text] = row
+                        writes["Mistakes"] = [
+                            [row.get(c, "") for c in EXPECTED_Q_COLS] for row in new_wrong.values()
+                        ]
 
-                    if st.button("🔄 重測"):
-                        st.session_state.quiz_data = None
-                        st.session_state.quiz_submitted = False
-                        st.rerun()
-    else:
-        st.warning("題庫目前是空的，請先匯入 PDF。")
+                    # 寫入失敗（已經 st.error 過）就不標記，下次 rerun 會再送一次
+                    if append_rows_batch(writes):
+                        st.session_state.quiz_saved = True
+                        if new_wrong:
+                            st.toast(f"已同步 {len(new_wrong)} 題到雲端錯題本！", icon="☁️")
+
+                if st.button("🔄 重測"):
+                    st.session_state.quiz_data = None
+                    st.session_state.quiz_submitted = False
+                    st.rerun()
+
+        render_quiz()
 
 
 # =========================================================
@@ -731,50 +411,41 @@ elif mode == "📕 錯題本 (雲端同步)":
 
         st.write(f"目前雲端累積：{len(mistake_df)} 題")
         if st.button("🎲 抽題練習"):
-            st.session_state.current_single_q = mistake_df.sample(1).iloc[0]
+            st.session_state.current_single_q = mistake_df.iloc[random.randrange(len(mistake_df))]
+            st.session_state.current_single_q_labels = option_labels(st.session_state.current_single_q)
             st.session_state.single_q_revealed = False
+            st.session_state.mistakes_qset = set()
 
         q = st.session_state.current_single_q
         if q is not None:
             st.markdown(f"### {q['question']}")
-            opts = ["A", "B", "C", "D"]
-            opt_labels = [
-                str(q.get("option_A", "")),
-                str(q.get("option_B", "")),
-                str(q.get("option_C", "")),
-                str(q.get("option_D", "")),
-            ]
-            clean_labels = [l.replace("nan", "").strip() for l in opt_labels]
-
-            user_ans = st.radio(
-                "選",
-                opts,
-                label_visibility="collapsed",
-                format_func=lambda x: clean_labels[opts.index(x)] if clean_labels[opts.index(x)] else f"{x}（空）",
-            )
-
-            c1, c2 = st.columns(2)
-            with c1:
-                if st.button("看答案"):
+            # 選項文字抽題時就算好了，之後每次 rerun 直接拿
+            labels = st.session_state.current_single_q_labels
+
+            # 包在 form 裡：點選項不會 rerun，按「看答案」才整頁跑一次
+            with st.form("mistake_q_form"):
+                user_ans = st.radio(
+                    "選",
+                    OPTS,
+                    label_visibility="collapsed",
+                    format_func=labels.get,
+                )
+                if st.form_submit_button("看答案"):
                     st.session_state.single_q_revealed = True
 
             if st.session_state.single_q_revealed:
                 ans = extract_answer_key(q.get("correct_answer", ""))
                 if user_ans == ans:
                     st.success(MSG_CORRECT)
-                    with c2:
-                        if st.button("🗑️ 從雲端移除"):
-                            latest_mistakes = load_data("Mistakes")
-                            new_mistakes = latest_mistakes[latest_mistakes["question"] != q["question"]]
-                            save_to_google("Mistakes", new_mistakes)
-                            st.success("已移除")
-                            st.session_state.current_single_q = None
-                            st.rerun()
+                    if st.button("🗑️ 從雲端移除"):
+                        # 只刪這題那一列，不再整張讀下來再整張覆蓋
+                        delete_rows_by_question("Mistakes", str(q["question"]))
+                        st.session_state.mistakes_qset.discard(str(q["question"]))
+                        st.success("已移除")
+                        st.session_state.current_single_q = None
+                        st.rerun()
                 else:
-                    try:
-                        txt = clean_labels[["A", "B", "C", "D"].index(ans)]
-                    except Exception:
-                        txt = ans
+                    txt = labels.get(ans, ans)
                     st.error(f"{MSG_WRONG} 正確是：{txt}")
 
                 st.info(f"解析：{q.get('explanation','')}")
@@ -785,59 +456,61 @@ elif mode == "📕 錯題本 (雲端同步)":
 # =========================================================
 elif mode == "⚡ 單題即時練習":
     st.title("⚡ 雲端單題刷")
-    df = load_data("Questions")
+    df = get_question_bank()
     if df.empty:
         st.warning("無題目")
     else:
-        df["type"] = df["type"].astype(str).replace({"": "choice"})
-        choice_df = df[df["type"].astype(str).str.lower().eq("choice")].copy()
+        if st.button("🔄 重新載入題庫"):
+            # 讀取有 cache_data，不清掉會拿回同一份舊題庫
+            clear_read_cache()
+            st.session_state.questions_df = None
+            st.rerun()
+
+        choice_df = df[df["type"].eq("choice")].copy()
         choice_df = choice_df[choice_df["option_A"].notna() & (choice_df["option_A"].astype(str).str.strip() != "")]
 
         if choice_df.empty:
             st.warning("無可用選擇題（可能解析後都是 essay 題型）")
         else:
             if st.button("🎲 抽題"):
-                st.session_state.current_single_q = choice_df.sample(1).iloc[0]
+                st.session_state.current_single_q = choice_df.iloc[random.randrange(len(choice_df))]
+                st.session_state.current_single_q_labels = option_labels(st.session_state.current_single_q)
                 st.session_state.single_q_revealed = False
+                st.session_state.mistakes_qset = set()
 
             q = st.session_state.current_single_q
             if q is not None:
                 st.markdown(f"### {q['question']}")
-                opts = ["A", "B", "C", "D"]
-                opt_labels = [
-                    str(q.get("option_A", "")),
-                    str(q.get("option_B", "")),
-                    str(q.get("option_C", "")),
-                    str(q.get("option_D", "")),
-                ]
-                clean_labels = [l.replace("nan", "").strip() for l in opt_labels]
-
-                user_ans = st.radio(
-                    "選",
-                    opts,
-                    label_visibility="collapsed",
-                    format_func=lambda x: clean_labels[opts.index(x)] if clean_labels[opts.index(x)] else f"{x}（空）",
-                )
-
-                if st.button("看答案"):
-                    st.session_state.single_q_revealed = True
+                # 選項文字抽題時就算好了，之後每次 rerun 直接拿
+                labels = st.session_state.current_single_q_labels
+
+                # 包在 form 裡：點選項不會 rerun，按「看答案」才整頁跑一次
+                with st.form("single_q_form"):
+                    user_ans = st.radio(
+                        "選",
+                        OPTS,
+                        label_visibility="collapsed",
+                        format_func=labels.get,
+                    )
+                    if st.form_submit_button("看答案"):
+                        st.session_state.single_q_revealed = True
 
                 if st.session_state.single_q_revealed:
                     ans = extract_answer_key(q.get("correct_answer", ""))
                     if user_ans == ans:
                         st.success(MSG_CORRECT)
                     else:
-                        try:
-                            txt = clean_labels[["A", "B", "C", "D"].index(ans)]
-                        except Exception:
-                            txt = ans
+                        txt = labels.get(ans, ans)
                         st.error(f"{MSG_WRONG} 正確是：{txt}")
 
-                        old_mistakes = load_data("Mistakes")
-                        new_mistakes = pd.concat([old_mistakes, pd.DataFrame([q])], ignore_index=True)
-                        new_mistakes.drop_duplicates(subset=["question"], keep="last", inplace=True)
-                        save_to_google("Mistakes", new_mistakes)
-                        st.caption("已同步到雲端錯題本")
+                        # 錯題本沒有才追加一列（不再整張讀下來再整張覆蓋）
+                        q_text = str(q["question"])
+                        if q_text not in st.session_state.mistakes_qset:
+                            # 寫入失敗就不記，下次 rerun 會再試
+                            if q_text in question_index("Mistakes") or append_records("Mistakes", [q.to_dict()]):
+                                st.session_state.mistakes_qset.add(q_text)
+                        if q_text in st.session_state.mistakes_qset:
+                            st.caption("已同步到雲端錯題本")
 
                     st.info(f"解析：{q.get('explanation','')}")
 
@@ -850,29 +523,39 @@ elif mode == "📂 匯入 PDF (上傳雲端)":
     uploaded_file = st.file_uploader("PDF", type=["pdf"])
 
     if uploaded_file and st.button("解析並上傳"):
-        with pdfplumber.open(uploaded_file) as pdf:
-            text = ""
-            for page in pdf.pages:
-                t = page.extract_text()
-                if t:
-                    text += t + "\n"
-
-        data = parse_exam_pdf(text)
-        if data:
-            new_df = pd.DataFrame(data)
-
-            for c in EXPECTED_Q_COLS:
-                if c not in new_df.columns:
-                    new_df[c] = ""
-            new_df = new_df[EXPECTED_Q_COLS]
+        # PDF 套件很肥，只有真的要匯入才載入（只考試的人不用付這個啟動成本）
+        from pdf_text import count_pdf_pages, iter_pdf_pages
+
+        pdf_bytes = uploaded_file.getvalue()
+        n_pages = count_pdf_pages(pdf_bytes)
+        progress = st.progress(0.0, text="解析 PDF 中…")
+
+        def iter_lines():
+            # 一頁一頁餵給 parser，順便更新進度條
+            for i, page_text in enumerate(iter_pdf_pages(pdf_bytes, n_pages)):
+                progress.progress((i + 1) / max(n_pages, 1), text=f"解析 PDF 中… {i + 1}/{n_pages} 頁")
+                yield from page_text.splitlines()
+
+        cols = parse_exam_pdf_columns(iter_lines())
+        progress.empty()
+        if cols["question"]:
+            # 已經是 EXPECTED_Q_COLS 欄序的 dict-of-lists，逐欄建表即可，不必補欄/重排
+            new_df = pd.DataFrame(cols, copy=False)
 
             st.success(f"解析成功 {len(new_df)} 題（含 choice/essay 混合）")
 
             old_df = load_data("Questions")
-            final_df = pd.concat([old_df, new_df], ignore_index=True)
-            final_df.drop_duplicates(subset=["question"], keep="last", inplace=True)
-
-            save_to_google("Questions", final_df)
+            new_df = new_df.drop_duplicates(subset=["question"], keep="last")
+            replaced = old_df["question"].astype(str).isin(set(new_df["question"].astype(str)))
+            if not replaced.any():
+                # 全是新題：只追加這些列，不必 concat 整份再整張覆蓋
+                append_rows_batch({"Questions": df_to_rows(new_df)})
+            else:
+                # 有舊題要更新（後匯入的蓋掉舊的）：舊表只拿掉被蓋掉的那幾題再接上新題，
+                # 不用對合併後的整張表再跑一次 drop_duplicates
+                final_df = pd.concat([old_df[~replaced], new_df], ignore_index=True)
+                save_to_google("Questions", final_df)
+            st.session_state.questions_df = None
             st.success("✅ 已成功寫入 Google Sheet！")
         else:
             st.error("❌ 解析不到題目，請確認 PDF 是否可被擷取文字（不是掃描圖）。")
@@ -882,14 +565,15 @@ elif mode == "📂 匯入 PDF (上傳雲端)":
 # Debug
 # =========================================================
 elif mode == "debug 雲端資料檢查":
-    st.subheader("Questions 表")
-    st.dataframe(load_data("Questions"), use_container_width=True)
-
-    st.subheader("Mistakes 表")
-    st.dataframe(load_data("Mistakes"), use_container_width=True)
-
-    st.subheader("Users 表")
-    st.dataframe(load_users(), use_container_width=True)
+    # 其它頁面的讀取有快取；直接在 Google Sheet 上改資料後，按這裡其它頁面也會馬上看到
+    if st.button("🔄 重新整理（清除快取）"):
+        clear_read_cache()
+        st.session_state.questions_df = None
+        st.rerun()
 
-    st.subheader("Results 表")
-    st.dataframe(load_results(), use_container_width=True)
+    # 四張表一次 batchGet 直接讀雲端；預設只讀前幾列，要看整張再勾
+    show_all = st.checkbox("載入整張表")
+    tables = read_many(["Questions", "Mistakes", "Users", "Results"], n_rows=None if show_all else 20)
+    for name, df in tables.items():
+        st.subheader(f"{name} 表")
+        st.dataframe(df, use_container_width=True)
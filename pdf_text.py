@@ -0,0 +1,123 @@
+"""
+PDF -> 純文字（匯入題庫用）。
+
+獨立成一個模組，是因為多行程擷取的 worker 必須能被 pickle：
+Streamlit 會把 app.py 當 __main__ 執行，子行程拿不到 app.py 裡定義的函式。
+"""
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+# PyMuPDF：純文字擷取比 pdfplumber 快很多
+# 新版的模組名是 pymupdf；舊版只有 fitz（PyPI 上另有一個不相干的 fitz 套件，所以先試新名字）
+try:
+    import pymupdf as fitz
+except ImportError:
+    try:
+        import fitz
+    except ImportError:
+        fitz = None
+
+# pdfplumber 會連帶載入 pdfminer/Pillow 等一大串，只有沒裝 PyMuPDF 時才需要
+if fitz is None:
+    import pdfplumber
+
+# 頁數太少就不開行程池（開行程的成本會比省下來的還多）
+PARALLEL_MIN_PAGES = 20
+# 每個行程都會自己開一份 PDF，開太多只是吃記憶體（雲端機器核心也不多），4 個就夠
+MAX_WORKERS = 4
+
+
+def count_pdf_pages(data: bytes) -> int:
+    if fitz is not None:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            return len(doc)
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        return len(pdf.pages)
+
+
+def _plumber_page_text(page) -> str:
+    """
+    pdfplumber 單頁擷取：明確用 layout=False（不做版面模擬，比較快），
+    擷取完馬上 flush_cache，不然整份 PDF 的字元物件會一直留在記憶體裡。
+    """
+    text = page.extract_text(layout=False) or ""
+    page.flush_cache()
+    return text
+
+
+def _extract_page_range(data: bytes, start: int, stop: int) -> list:
+    """
+    擷取第 [start, stop) 頁的文字。
+    每個行程自己開一份文件：PyMuPDF 不能跨執行緒共用，所以平行化用行程不用執行緒。
+    """
+    if fitz is not None:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            return [doc[i].get_text("text") for i in range(start, stop)]
+
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        return [_plumber_page_text(pdf.pages[i]) for i in range(start, stop)]
+
+
+def _iter_pages_sequential(data: bytes):
+    if fitz is not None:
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            for page in doc:
+                yield page.get_text("text")
+        return
+
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        for page in pdf.pages:
+            yield _plumber_page_text(page)
+
+
+_main_lock = threading.Lock()
+
+
+@contextmanager
+def _without_main_script():
+    """
+    spawn 出來的子行程會照 sys.modules["__main__"].__file__ 先把主程式跑一遍，
+    在 Streamlit 底下那就是 app.py（沒有 script context，跑到要登入的地方就炸，整個行程池 BrokenProcessPool）。
+    開子行程的這段期間把 __main__ 換成沒有 __file__ 的空模組，子行程就只會 import 這個模組。
+    __main__ 是全域的，多個 session 同時匯入時用鎖排隊，才不會還原錯。
+    """
+    with _main_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            yield
+        finally:
+            sys.modules["__main__"] = main
+
+
+def iter_pdf_pages(data: bytes, n_pages: int = None):
+    """
+    照頁序逐頁產生文字，呼叫端可以邊拿邊解析（不用先把整份 PDF 接成一個大字串）。
+    有裝 PyMuPDF 就用它（C 實作，比 pdfminer 快一個數量級），沒有才退回 pdfplumber。
+    大份 PDF 會切成幾段頁碼，丟給多個行程同時擷取。
+    """
+    if n_pages is None:
+        n_pages = count_pdf_pages(data)
+    workers = min(MAX_WORKERS, os.cpu_count() or 1)
+
+    if n_pages < PARALLEL_MIN_PAGES or workers < 2:
+        yield from _iter_pages_sequential(data)
+        return
+
+    step = -(-n_pages // workers)  # 無條件進位
+    starts = list(range(0, n_pages, step))
+    stops = [min(s + step, n_pages) for s in starts]
+    # 用 spawn 開子行程：Streamlit server 本身是多執行緒的，fork 可能把別的執行緒拿著的鎖一起複製過去而卡死
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(starts), mp_context=ctx) as ex:
+        # submit 時就會把子行程開起來，__main__ 只需要在這段換掉，之後 yield 回 app 時已經還原
+        with _without_main_script():
+            futures = [ex.submit(_extract_page_range, data, a, b) for a, b in zip(starts, stops)]
+        for f in futures:
+            yield from f.result()
@@ -0,0 +1,714 @@
+"""
+RPO 特訓平台的非 UI 核心：資料表 schema、Google Sheets 讀寫、帳密雜湊、題目解析。
+
+app.py 只負責畫面；這裡的東西可以直接 import（例如離線測 parse_exam_pdf），
+不會觸發 Streamlit 的頁面設定與 UI。
+"""
+import streamlit as st
+import pandas as pd
+import re
+import gspread
+import hashlib, hmac
+import numbers
+import functools
+import random
+import time
+from gspread.exceptions import APIError, WorksheetNotFound
+
+# =========================================================
+# 資料表設定
+# =========================================================
+SHEET_NAME = "Pro_Database"  # Google Sheet 檔名（不是分頁名）
+
+EXPECTED_Q_COLS = [
+    "question", "option_A", "option_B", "option_C", "option_D",
+    "correct_answer", "explanation", "topic", "type"
+]
+USER_COLS = ["username", "password_hash", "role", "created_at", "enabled"]
+RESULT_COLS = ["ts", "username", "mode", "score", "total", "percent", "wrong_count"]
+
+DEFAULT_HEADERS = {
+    "Questions": EXPECTED_Q_COLS,
+    "Mistakes": EXPECTED_Q_COLS,
+    "Users": USER_COLS,
+    "Results": RESULT_COLS,
+}
+# 新建分頁時的大小（rows, cols），沒列到的用 get_or_create_worksheet 預設值
+WORKSHEET_SIZES = {
+    "Results": (8000, 20),
+}
+
+
+# =========================================================
+# Google Sheets 連線
+# =========================================================
+def with_backoff(max_attempts=5, retry_status=(429, 500, 503)):
+    """
+    Sheets API 很容易回 429（每分鐘配額）或偶發 5xx：等 2^i 秒 + 隨機抖動再重試，
+    最多 max_attempts 次，還是失敗才把例外丟出去。
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                try:
+                    return fn(*args, **kwargs)
+                except APIError as e:
+                    status = getattr(e.response, "status_code", None)
+                    if status not in retry_status or attempt == max_attempts - 1:
+                        raise
+                    time.sleep(2 ** attempt + random.random())
+        return wrapper
+    return decorator
+
+
+@st.cache_resource
+def init_connection():
+    scope = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive",
+    ]
+    if "gcp_service_account" not in st.secrets:
+        st.error("⚠️ 未偵測到 Secrets 設定！請在 Streamlit Cloud 後台設定 [gcp_service_account]。")
+        return None
+
+    # gspread 內建的 google-auth 登入（oauth2client 已停止維護，import 也慢）
+    return gspread.service_account_from_dict(dict(st.secrets["gcp_service_account"]), scopes=scope)
+
+
+def get_or_create_worksheet(sh, name, rows=2000, cols=30):
+    """
+    強化版：避免 Streamlit rerun / 多 session 併發時重複建立同名 sheet。
+    就算 add_worksheet 回 400 already exists，也能安全拿回現有 worksheet。
+    若是新建，會自動寫入對應的 header。
+    """
+    name = str(name).strip()
+
+    # 1) 先直接拿
+    try:
+        return sh.worksheet(name)
+    except WorksheetNotFound:
+        pass
+
+    # 2) 再掃一次
+    try:
+        for ws in sh.worksheets():
+            if ws.title.strip() == name:
+                return ws
+    except Exception:
+        pass
+
+    # 3) 建立（撞名就回頭拿現成）
+    try:
+        ws = sh.add_worksheet(title=name, rows=rows, cols=cols)
+    except APIError as e:
+        msg = str(e)
+        if ("already exists" in msg) or ("addSheet" in msg):
+            return sh.worksheet(name)
+        raise
+
+    # 4) 新建才寫 header
+    headers = DEFAULT_HEADERS.get(name)
+    if headers:
+        ws.append_row(headers)
+    return ws
+
+
+@st.cache_resource
+def open_spreadsheet():
+    """client.open 要打一次 Drive API，整個 process 開一次就好"""
+    client = init_connection()
+    if not client:
+        return None
+    return client.open(SHEET_NAME)
+
+
+@st.cache_resource
+def _worksheets_by_title() -> dict:
+    # 一次 sh.worksheets()（一個 metadata 請求）拿回所有分頁，冷啟動時不必每張表各查一次
+    sh = open_spreadsheet()
+    if sh is None:
+        return {}
+    return {ws.title.strip(): ws for ws in sh.worksheets()}
+
+
+@st.cache_resource
+def get_worksheet(name: str):
+    """
+    分頁 handle 也快取起來，之後讀寫都不用再 sh.worksheet(name)。
+    先查分頁清單，真的沒有才走 get_or_create_worksheet 建立。
+    分頁被手動刪掉時 handle 會失效，讀寫失敗會呼叫 reset_worksheets() 重拿。
+    """
+    sh = open_spreadsheet()
+    if sh is None:
+        return None
+    ws = _worksheets_by_title().get(name)
+    if ws is not None:
+        return ws
+    rows, cols = WORKSHEET_SIZES.get(name, (2000, 30))
+    return get_or_create_worksheet(sh, name, rows=rows, cols=cols)
+
+
+def reset_worksheets():
+    """連線/分頁出錯時呼叫：分頁 handle 和分頁清單一起清掉重拿"""
+    get_worksheet.clear()
+    _worksheets_by_title.clear()
+
+
+# =========================================================
+# Auth（簡單帳號密碼 / 成績紀錄）
+# =========================================================
+def _get_auth_pepper():
+    # 建議在 secrets 加：auth_pepper = "一串很亂很長的字串"
+    return st.secrets.get("auth_pepper", "CHANGE_ME_PLEASE")
+
+def hash_password(password: str, salt: str) -> str:
+    pepper = _get_auth_pepper().encode("utf-8")
+    dk = hashlib.pbkdf2_hmac(
+        "sha256",
+        (password.strip().encode("utf-8") + pepper),
+        salt.encode("utf-8"),
+        120_000,
+    )
+    return dk.hex()
+
+def verify_password(password: str, salt: str, stored_hash: str) -> bool:
+    return hmac.compare_digest(hash_password(password, salt), str(stored_hash))
+
+# =========================================================
+# 資料讀寫（Questions/Mistakes/Users/Results）
+# =========================================================
+@with_backoff()
+def _read_worksheet(worksheet_name: str) -> pd.DataFrame:
+    """實際打 Google Sheets 讀整張表（不快取）；失敗直接丟例外，交給 load_data 處理"""
+    ws = get_worksheet(worksheet_name)
+    if ws is None:
+        return pd.DataFrame()
+
+    # get_all_values：一次拿整張 2D list，直接丟給 pandas 建表，
+    # 不用 get_all_records 那樣一列一列組 dict
+    return _values_to_df(ws.get_all_values())
+
+
+def _values_to_df(values: list) -> pd.DataFrame:
+    """2D list（第一列是表頭）-> DataFrame"""
+    if len(values) < 2:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(values[1:], columns=values[0])
+    # 空白/重複的表頭（多半是表格右邊的空欄）直接丟掉
+    return df.loc[:, (df.columns != "") & ~df.columns.duplicated()]
+
+
+@with_backoff()
+def _batch_read(names: list, n_rows) -> dict:
+    sh = open_spreadsheet()
+    if sh is None:
+        return {n: pd.DataFrame() for n in names}
+    for n in names:
+        get_worksheet(n)  # 分頁不存在就先建（handle 有快取，平常不打 API）
+
+    # 幾張表包成一個 values.batchGet；n_rows=None 讀整張
+    end = f"Z{n_rows + 1}" if n_rows else "Z"
+    resp = sh.values_batch_get([f"'{n}'!A1:{end}" for n in names])
+
+    out = {}
+    for n, vr in zip(names, resp.get("valueRanges", [])):
+        # 每列尾端的空格會被省略，補成同寬
+        values = vr.get("values", [])
+        width = max((len(r) for r in values), default=0)
+        out[n] = _values_to_df([r + [""] * (width - len(r)) for r in values])
+    return out
+
+
+def read_many(names: list, n_rows: int = 20) -> dict:
+    """
+    檢查頁用：一次 API 讀回多張表（不走快取），回傳 {分頁名: DataFrame}。
+    預設只讀前 n_rows 列；n_rows=None 讀整張。
+    """
+    try:
+        return _batch_read(names, n_rows)
+    except Exception as e:
+        reset_worksheets()
+        st.error(f"連線/資料錯誤\n詳細錯誤: {repr(e)}")
+        return {n: pd.DataFrame() for n in names}
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_records(worksheet_name: str) -> pd.DataFrame:
+    """
+    _read_worksheet 的快取版（5 分鐘）。
+    Streamlit 每點一下就 rerun，沒快取的話每次都要重抓；寫入後會呼叫 clear_read_cache()。
+    例外不會被快取。
+    """
+    return _read_worksheet(worksheet_name)
+
+
+def load_data(worksheet_name: str) -> pd.DataFrame:
+    """通用讀取：保證回傳 DataFrame，且必要欄位會補齊"""
+    expected = DEFAULT_HEADERS.get(worksheet_name, None)
+
+    try:
+        df = fetch_records(worksheet_name)
+        if df.empty:
+            return pd.DataFrame(columns=expected or [])
+
+        # 補欄位
+        if expected:
+            return df.reindex(columns=expected, fill_value="")
+
+        return df
+
+    except Exception as e:
+        reset_worksheets()
+        st.error(
+            "連線/資料錯誤（可能是欄位被刪、或資料表空白）\n"
+            f"詳細錯誤: {repr(e)}"
+        )
+        return pd.DataFrame(columns=expected or [])
+
+
+@st.cache_resource(ttl=300, show_spinner=False)
+def _question_index(worksheet_name: str) -> frozenset:
+    # frozenset 不可變，用 cache_resource 共用同一份（cache_data 每次都會複製）
+    df = fetch_records(worksheet_name)
+    if "question" not in df.columns:
+        return frozenset()
+    return frozenset(df["question"].astype(str))
+
+
+def question_index(worksheet_name: str) -> frozenset:
+    """
+    分頁裡所有題目文字的集合：判斷「某題在不在錯題本」O(1) 查，不必每次整欄字串比對。
+    失敗時回空集合（不快取），跟 load_data 一樣顯示錯誤。
+    """
+    try:
+        return _question_index(worksheet_name)
+    except Exception as e:
+        reset_worksheets()
+        st.error(f"連線/資料錯誤\n詳細錯誤: {repr(e)}")
+        return frozenset()
+
+
+def clear_read_cache():
+    """寫入後呼叫：整表快取和題目索引一起清掉"""
+    fetch_records.clear()
+    _question_index.clear()
+
+
+def df_to_rows(df: pd.DataFrame) -> list:
+    """DataFrame -> 2D list（NaN/None 轉空字串）；直接走 itertuples，不另外複製一份整張表"""
+    return [
+        ["" if v is None or v != v else v for v in row]
+        for row in df.itertuples(index=False, name=None)
+    ]
+
+
+@with_backoff()
+def _overwrite_worksheet(ws, values: list):
+    """
+    清空 + 寫入包成同一個 spreadsheets.batchUpdate：只打一次 API，
+    而且整包是原子的，別人不會讀到中間那一下空表。重做一次結果一樣，5xx 也可以安心重試。
+    updateCells 只能寫在現有格子裡，資料比表大時先把表撐大（只增不減）。
+    """
+    # 表的大小要現查：快取的 ws.row_count 在 appendCells 長大 / deleteDimension 刪列之後就不準了
+    meta = ws.spreadsheet.fetch_sheet_metadata(
+        {"fields": "sheets.properties(sheetId,gridProperties(rowCount,columnCount))"}
+    )
+    grid = next(
+        s["properties"]["gridProperties"] for s in meta["sheets"] if s["properties"]["sheetId"] == ws.id
+    )
+    n_rows = len(values)
+    n_cols = max((len(r) for r in values), default=0)
+
+    requests = []
+    if n_rows > grid["rowCount"] or n_cols > grid["columnCount"]:
+        requests.append({
+            "updateSheetProperties": {
+                "properties": {
+                    "sheetId": ws.id,
+                    "gridProperties": {
+                        "rowCount": max(grid["rowCount"], n_rows),
+                        "columnCount": max(grid["columnCount"], n_cols),
+                    },
+                },
+                "fields": "gridProperties.rowCount,gridProperties.columnCount",
+            }
+        })
+    requests += [
+        # 不給 rows = 把整張表的值清掉（格式保留，跟 ws.clear() 一樣）
+        {"updateCells": {"range": {"sheetId": ws.id}, "fields": "userEnteredValue"}},
+        {
+            "updateCells": {
+                "start": {"sheetId": ws.id, "rowIndex": 0, "columnIndex": 0},
+                "rows": [{"values": [_to_cell(v) for v in r]} for r in values],
+                "fields": "userEnteredValue",
+            }
+        },
+    ]
+    ws.spreadsheet.batch_update({"requests": requests})
+
+
+def save_to_google(worksheet_name: str, new_df: pd.DataFrame):
+    """覆蓋寫入（適用 Questions / Mistakes / Users），Results 請用 append_rows_batch"""
+    try:
+        ws = get_worksheet(worksheet_name)
+        if ws is None:
+            st.error("❌ 無法建立 Google Sheets 連線（Secrets 可能未設定）")
+            return
+
+        expected = DEFAULT_HEADERS.get(worksheet_name)
+        if expected and new_df is not None:
+            new_df = new_df.reindex(columns=expected, fill_value="")
+
+        if new_df is None or new_df.empty:
+            values = [expected or []]
+        else:
+            values = [new_df.columns.values.tolist()] + df_to_rows(new_df)
+        _overwrite_worksheet(ws, values)
+
+    except Exception as e:
+        reset_worksheets()
+        st.error(f"寫入失敗: {repr(e)}")
+    finally:
+        clear_read_cache()
+
+
+def _to_cell(v) -> dict:
+    """Python 值 -> Sheets API CellData（數字維持數字，其它一律字串）"""
+    if isinstance(v, numbers.Number) and not isinstance(v, bool) and v == v:
+        return {"userEnteredValue": {"numberValue": float(v)}}
+    if v is None or (isinstance(v, float) and v != v):
+        v = ""
+    return {"userEnteredValue": {"stringValue": str(v)}}
+
+
+def append_rows_batch(rows_by_sheet: dict):
+    """
+    一次追加多張表：{分頁名: [[...], [...]], ...}
+    全部包成一個 spreadsheets.batchUpdate（appendCells），交卷時只打一次寫入 API，
+    不會像以前 Mistakes 全表覆蓋 + Results append 各打一輪，也比較不會撞到 429 配額。
+    回傳是否寫入成功（失敗時已經 st.error 過）。
+    """
+    rows_by_sheet = {k: v for k, v in rows_by_sheet.items() if v}
+    if not rows_by_sheet:
+        return True
+
+    try:
+        sh = open_spreadsheet()
+        if sh is None:
+            st.error("❌ 無法建立 Google Sheets 連線")
+            return False
+
+        header_ok = st.session_state.setdefault("header_ok", set())
+        requests = []
+        checked = []
+        for name, rows in rows_by_sheet.items():
+            ws = get_worksheet(name)
+
+            # 若表是空的（沒 header），補 header；這個 session 確認過的表就不再多打一次 API
+            headers = DEFAULT_HEADERS.get(name)
+            if headers and name not in header_ok:
+                if not ws.row_values(1):
+                    rows = [headers] + list(rows)
+                checked.append(name)
+
+            requests.append({
+                "appendCells": {
+                    "sheetId": ws.id,
+                    "rows": [{"values": [_to_cell(v) for v in r]} for r in rows],
+                    "fields": "userEnteredValue",
+                }
+            })
+
+        # appendCells 不是冪等的：5xx 時可能其實已經寫進去，只對 429（確定被擋下）重試
+        with_backoff(retry_status=(429,))(sh.batch_update)({"requests": requests})
+        header_ok.update(checked)
+        return True
+
+    except Exception as e:
+        reset_worksheets()
+        st.error(f"寫入失敗: {repr(e)}")
+        return False
+    finally:
+        clear_read_cache()
+
+
+def delete_rows_by_question(worksheet_name: str, question: str):
+    """
+    刪掉 question 欄等於指定題目的那幾列（錯題本移除用），不必整張讀下來再整張覆蓋。
+    列號用當下的題目欄現算（只讀一欄），不用快取的表，免得別人剛好增刪過列而刪錯。
+    """
+    try:
+        ws = get_worksheet(worksheet_name)
+        if ws is None:
+            st.error("❌ 無法建立 Google Sheets 連線")
+            return
+
+        col = with_backoff()(ws.col_values)(1)
+        if not col or col[0] != "question":
+            # 表頭被手動動過、第一欄不是題目：退回整張重寫
+            df = load_data(worksheet_name)
+            save_to_google(worksheet_name, df[df["question"] != question])
+            return
+
+        hits = [i for i, v in enumerate(col) if i > 0 and v == question]
+        if not hits:
+            return
+        # 從下面往上刪，前面的列號才不會跟著位移；全部包成一個 batchUpdate
+        requests = [
+            {
+                "deleteDimension": {
+                    "range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": i, "endIndex": i + 1}
+                }
+            }
+            for i in reversed(hits)
+        ]
+        # 刪列不是冪等的：只對 429（確定被擋下）重試
+        with_backoff(retry_status=(429,))(ws.spreadsheet.batch_update)({"requests": requests})
+
+    except Exception as e:
+        reset_worksheets()
+        st.error(f"寫入失敗: {repr(e)}")
+    finally:
+        clear_read_cache()
+
+
+def append_records(worksheet_name: str, records: list):
+    """
+    追加幾筆 dict 到指定分頁（欄位照 DEFAULT_HEADERS 排）。
+    單筆新增不用先整張讀下來再整張覆蓋回去，只送新的那幾列。回傳是否寫入成功。
+    """
+    cols = DEFAULT_HEADERS[worksheet_name]
+    return append_rows_batch({worksheet_name: [[r.get(c, "") for c in cols] for r in records]})
+
+
+def load_users() -> pd.DataFrame:
+    df = load_data("Users").reindex(columns=USER_COLS, fill_value="")
+    # enabled 預設 true
+    df["enabled"] = df["enabled"].astype(str).replace({"": "TRUE"})
+    return df
+
+
+def save_users(df: pd.DataFrame):
+    save_to_google("Users", df.reindex(columns=USER_COLS, fill_value=""))
+
+
+def load_results() -> pd.DataFrame:
+    return load_data("Results").reindex(columns=RESULT_COLS, fill_value="")
+
+
+# =========================================================
+# 題目工具
+# =========================================================
+ANSWER_KEY_MAP = {"1": "A", "2": "B", "3": "C", "4": "D"}
+# 答案欄多半就一個字（A / 3 / c）：直接查表，不用進 regex
+_ANSWER_KEY_SINGLE = {**ANSWER_KEY_MAP, **{k: k for k in "ABCD"}, **{k.lower(): k for k in "ABCD"}}
+
+# PDF 解析會逐行呼叫，regex 先編譯好放模組層
+_RE_ANSWER_KEY = re.compile(r"^[\(（]?([1-4A-Da-d])[\)）\.]?")
+_RE_FOOTER = re.compile(r"^第\s*\d+\s*頁/共\s*\d+\s*頁")
+_RE_ANSWER_PREFIX = re.compile(r".*\[解(?:[:：])?\]\s*")  # 一次判斷 + 切掉 [解:] 前面
+_RE_OPTION_SPLIT = re.compile(r"([（(][1-4][）)])")  # 支援 (1) 或 （1），整個記號當分隔並保留
+OPTION_KEYS = {"1": "option_A", "2": "option_B", "3": "option_C", "4": "option_D"}
+_RE_NEW_Q = re.compile(r"^\d+[\.\s]")
+
+
+def extract_answer_key(text):
+    # 幾乎都是 str，先走這條，不必每次都進 pd.isna
+    if not isinstance(text, str):
+        if pd.isna(text):
+            return ""
+        text = str(text)
+    text = text.strip()
+    if len(text) == 1:
+        return _ANSWER_KEY_SINGLE.get(text, "")
+    match = _RE_ANSWER_KEY.match(text)
+    if match:
+        val = match.group(1).upper()
+        return ANSWER_KEY_MAP.get(val, val)
+    return ""
+
+
+def extract_answer_keys(s: pd.Series) -> pd.Series:
+    """extract_answer_key 的整欄版：一次對整個 Series 跑 regex（改卷用）"""
+    keys = (
+        s.fillna("").astype(str).str.strip()
+        .str.extract(_RE_ANSWER_KEY.pattern, expand=False)
+    )
+    # 抽出來的一定是 1-4 / A-D / a-d 其中一個字：一次 map 查表就同時做完轉大寫和數字轉字母
+    return keys.map(_ANSWER_KEY_SINGLE).fillna("")
+
+
+def parse_exam_pdf(text):
+    """一次解析整段文字（舊介面），逐頁串流請用 parse_exam_pdf_stream"""
+    return list(parse_exam_pdf_stream(text.split("\n")))
+
+
+def parse_exam_pdf_columns(lines) -> dict:
+    """
+    同 parse_exam_pdf_stream，但直接收成 {欄名: [值...]}（欄序 = EXPECTED_Q_COLS），
+    pd.DataFrame(cols) 逐欄建表，不用再從一堆 dict 轉置。
+    """
+    cols = {c: [] for c in EXPECTED_Q_COLS}
+    for q in parse_exam_pdf_stream(lines):
+        for c in EXPECTED_Q_COLS:
+            cols[c].append(q[c])
+    return cols
+
+
+def parse_exam_pdf_stream(lines):
+    """
+    v7.2+：
+    - 支援 [解:] / [解：] / [解]
+    - 選項記號可在行中，會完整拆 (1)(2)(3)(4)
+    - 選項跨行：沒有新 (n) 記號就接到上一個選項
+    - 題型辨識：少於 3 個選項 => essay（避免把(1)(2)子題當選擇）
+    - 忽略頁尾：第X頁/共Y頁
+    - 吃任意 iterable 的行、每解析完一題就 yield，整份 PDF 不必先接成一個大字串
+    """
+    current_q = None
+    state = "SEARCH_Q"
+    last_opt = None
+
+    def is_footer(s: str) -> bool:
+        # 呼叫端已經 strip 過；沒有「頁」字就不必跑 regex
+        return "頁" in s and bool(_RE_FOOTER.match(s))
+
+    def split_options_anywhere(s: str):
+        # 大部分行根本沒有括號，先擋掉
+        if "(" not in s and "（" not in s:
+            return {}
+        # 常見情況：整行就是一個選項「(n) ...」，後面沒有別的括號 -> 不用進 regex
+        if (
+            len(s) >= 3 and s[0] in "(（" and s[1] in "1234" and s[2] in ")）"
+            and "(" not in s[3:] and "（" not in s[3:]
+        ):
+            return {s[1]: s}
+        # re.split 帶 capture group：[前綴, "(1)", 內容, "(2)", 內容, ...]，一次掃完
+        parts = _RE_OPTION_SPLIT.split(s)
+        out = {}
+        for marker, body in zip(parts[1::2], parts[2::2]):
+            out[marker[1]] = (marker + body).strip()
+        return out
+
+    def finalize_question(q: dict) -> dict:
+        # 題幹/解析逐行先收在 list，收尾時一次 join（不要每行 += 重建整個字串）
+        q["question"] = " ".join(q["question"])
+        expl = q["explanation"]
+        q["explanation"] = "\n".join(expl) + "\n" if expl else ""
+
+        opts = [
+            str(q.get("option_A", "")).strip(),
+            str(q.get("option_B", "")).strip(),
+            str(q.get("option_C", "")).strip(),
+            str(q.get("option_D", "")).strip(),
+        ]
+        non_empty = [o for o in opts if o]
+
+        # 少於 3 個選項：視為非選擇題（(1)(2)子題很常見）
+        if len(non_empty) < 3:
+            q["type"] = "essay"
+            # 把可能被誤塞進選項的內容搬到 explanation（不要丟資料）
+            extra = []
+            if q.get("option_A"): extra.append(q["option_A"])
+            if q.get("option_B"): extra.append(q["option_B"])
+            if q.get("option_C"): extra.append(q["option_C"])
+            if q.get("option_D"): extra.append(q["option_D"])
+            if extra and not q.get("explanation"):
+                q["explanation"] = "\n".join(extra)
+
+            q["option_A"] = q["option_B"] = q["option_C"] = q["option_D"] = ""
+            q["correct_answer"] = ""
+        else:
+            q["type"] = "choice"
+        return q
+
+    for raw in lines:
+        line = raw.strip()
+        if not line or is_footer(line):
+            continue
+
+        # 新題目（題號 1. / 1 ）
+        if line[0].isdigit() and _RE_NEW_Q.match(line):
+            if current_q and "question" in current_q:
+                yield finalize_question(current_q)
+
+            current_q = {
+                "question": [line],
+                "option_A": "",
+                "option_B": "",
+                "option_C": "",
+                "option_D": "",
+                "correct_answer": "",
+                "explanation": [],
+                "topic": "",
+                "type": "choice",
+            }
+            state = "READING_Q"
+            last_opt = None
+            continue
+
+        if current_q is None:
+            continue
+
+        # 解答標記：先用便宜的子字串檢查擋掉絕大多數行，命中才跑 regex
+        marker = _RE_ANSWER_PREFIX.match(line) if "[解" in line else None
+        if marker:
+            after = line[marker.end():].strip()
+            if after:
+                ans = extract_answer_key(after)
+                if ans:
+                    current_q["correct_answer"] = ans
+                current_q["explanation"].append(after)
+                state = "READING_EXPL"
+            else:
+                state = "WAITING_FOR_ANS"
+            last_opt = None
+            continue
+
+        # 等待答案那行（通常只有 (3)）
+        if state == "WAITING_FOR_ANS":
+            ans = extract_answer_key(line)
+            if ans and not current_q.get("correct_answer"):
+                current_q["correct_answer"] = ans
+            current_q["explanation"].append(line)
+            state = "READING_EXPL"
+            continue
+
+        # 讀題幹：直到遇到任何 (1)-(4)
+        opts = None
+        if state == "READING_Q":
+            opts = split_options_anywhere(line)
+            if opts:
+                state = "READING_OPT"
+            else:
+                current_q["question"].append(line)
+                continue
+
+        # 讀選項：一行內可同時有多個 (n)（從讀題幹轉過來的那行不用再切一次）
+        if state == "READING_OPT":
+            if opts is None:
+                opts = split_options_anywhere(line)
+            if opts:
+                for n, key in OPTION_KEYS.items():
+                    if n in opts:
+                        current_q[key] = opts[n]
+                        last_opt = key
+                continue
+
+            # 沒有新選項記號 -> 接到上一個選項
+            if last_opt:
+                current_q[last_opt] = (current_q[last_opt] + " " + line).strip()
+                continue
+
+        # 解析內容
+        if state == "READING_EXPL":
+            if not current_q.get("correct_answer"):
+                ans = extract_answer_key(line)
+                if ans:
+                    current_q["correct_answer"] = ans
+            current_q["explanation"].append(line)
+
+    if current_q and "question" in current_q:
+        yield finalize_question(current_q)